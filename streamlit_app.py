@@ -1,66 +1,453 @@
 import streamlit as st
 import pandas as pd
-from io import BytesIO
+from io import BytesIO, StringIO
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 from streamlit.runtime.uploaded_file_manager import UploadedFile
-from typing import List, Tuple, Optional
+from typing import Callable, List, Tuple, Optional
 import unicodedata
 import re
+import codecs
+import hashlib
+import contextvars
 import numpy as np
+from pandas.api.types import union_categoricals
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+import xlsxwriter
+from openpyxl import load_workbook
+
+try:
+    import python_calamine  # noqa: F401  (motor 'calamine' de pd.read_excel)
+    CALAMINE_DISPONIBLE = True
+except ImportError:
+    CALAMINE_DISPONIBLE = False
 
 # --- Configuración de la Página ---
 st.set_page_config(page_title="Consolidador de Archivos", page_icon="📄", layout="wide")
 
 # ----- FUNCIÓN DE LIMPIEZA DE CARACTERES -----
 ILLEGAL_CHARACTERS_RE = re.compile(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F-\x9F]')
+# Mismo conjunto como tabla de borrado para str.translate: sin motor de regex en valores sueltos.
+# Las columnas completas siguen usando la regex, que pandas ejecuta vectorizada (en Arrow, con RE2).
+TABLA_CARACTERES_ILEGALES = dict.fromkeys(
+    [*range(0x00, 0x09), 0x0B, 0x0C, *range(0x0E, 0x20), *range(0x7F, 0xA0)]
+)
 
 def limpiar_caracteres_ilegales(valor):
     if isinstance(valor, str):
-        return ILLEGAL_CHARACTERS_RE.sub('', valor)
+        # ASCII imprimible (el caso habitual) no tiene nada que borrar: se evita armar otra cadena.
+        if valor.isascii() and valor.isprintable():
+            return valor
+        return valor.translate(TABLA_CARACTERES_ILEGALES)
     return valor
 
+def quitar_caracteres_ilegales(serie: pd.Series) -> pd.Series:
+    # Con el patrón como texto (no compilado) pandas usa los kernels de Arrow (RE2) en columnas str.
+    # contains es bastante más barato que replace y, en la columna típica, sin caracteres de
+    # control, evita armar una columna nueva.
+    if not serie.str.contains(ILLEGAL_CHARACTERS_RE.pattern, regex=True, na=False).any():
+        return serie
+    return serie.str.replace(ILLEGAL_CHARACTERS_RE.pattern, '', regex=True)
+
+def limpiar_columnas_texto(df: pd.DataFrame) -> None:
+    for col, serie in df.items():
+        if isinstance(serie.dtype, pd.CategoricalDtype):
+            # En las categóricas basta con limpiar el diccionario de categorías, no cada fila.
+            categorias = [limpiar_caracteres_ilegales(str(c)) for c in serie.cat.categories]
+            if len(set(categorias)) == len(categorias):
+                df[col] = serie.cat.rename_categories(categorias)
+            else:
+                # La limpieza hizo colisionar categorías; se recodifica por valor.
+                df[col] = quitar_caracteres_ilegales(serie.astype(str)).astype('category')
+        elif serie.dtype == object:
+            df[col] = quitar_caracteres_ilegales(serie.astype(str))
+        elif isinstance(serie.dtype, pd.StringDtype):
+            df[col] = quitar_caracteres_ilegales(serie)
+
 # --- Funciones de Utilidad ---
+POSIBLES_CODIFICACIONES = ['utf-16', 'utf-8-sig', 'utf-8', 'latin1', 'windows-1252']
+DECODIFICADORES = {encoding: codecs.lookup(encoding).incrementaldecoder for encoding in POSIBLES_CODIFICACIONES}
+SEPARADORES_CANDIDATOS = (',', ';', '\t', '|')
+CODIGOS_SEPARADORES = np.array([ord(sep) for sep in SEPARADORES_CANDIDATOS])
+TAMANO_MUESTRA = 64 * 1024
+FILAS_POR_BLOQUE = 10_000
+MAX_HILOS_LECTURA = 8
+MAX_FILAS_EXCEL = 1_048_576
+MAX_COLUMNAS_EXCEL = 16_384
+TTL_CACHE = '1h'
+FIRMA_OLE2 = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+
+def huella_dataframe(df: pd.DataFrame) -> tuple:
+    # hash_pandas_object es vectorizado en C; mucho más barato que el hasher genérico de st.cache_data.
+    # Los hashes por fila se digieren en orden (no se suman): el mismo contenido en otro orden de
+    # filas debe dar otra huella.
+    hashes_filas = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    return (df.shape, tuple(df.columns), tuple(map(str, df.dtypes)),
+            hashlib.blake2b(hashes_filas.tobytes(), digest_size=16).hexdigest())
+
+def elegir_escritor(hoja, dtype):
+    # El método de xlsxwriter se elige una vez por columna según su dtype, en lugar de que
+    # hoja.write() vuelva a inspeccionar el tipo de cada celda. Object queda con write() genérico.
+    if isinstance(dtype, pd.CategoricalDtype):
+        dtype = dtype.categories.dtype
+    if pd.api.types.is_bool_dtype(dtype):
+        return hoja.write_boolean
+    if pd.api.types.is_numeric_dtype(dtype):
+        return hoja.write_number
+    if pd.api.types.is_string_dtype(dtype) and dtype != object:
+        return hoja.write_string
+    return hoja.write
+
+def validar_tamano_excel(df: pd.DataFrame) -> None:
+    # Fuera de los límites de la hoja xlsxwriter no lanza error: write_* devuelve -1 y la celda se
+    # descarta, así que el archivo saldría truncado sin aviso.
+    if len(df) + 1 > MAX_FILAS_EXCEL or df.shape[1] > MAX_COLUMNAS_EXCEL:
+        raise ValueError(
+            f"el consolidado ({len(df)} filas × {df.shape[1]} columnas) excede el máximo de una hoja de Excel "
+            f"({MAX_FILAS_EXCEL - 1} filas de datos × {MAX_COLUMNAS_EXCEL} columnas). Descárguelo en Parquet o CSV.")
 
-@st.cache_data
-def convertir_a_excel(df: pd.DataFrame) -> bytes:
+def generar_excel(df: pd.DataFrame) -> bytes:
+    validar_tamano_excel(df)
+    # La limpieza solo hace falta en el archivo exportado, no para mostrar la tabla. Con
+    # Copy-on-Write la copia superficial basta: solo se reemplazan las columnas de texto.
+    df = df.copy(deep=False)
+    limpiar_columnas_texto(df)
     output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='Consolidado')
+    # constant_memory vuelca cada fila al avanzar, así que hay que escribir fila a fila:
+    # df.to_excel emite las celdas por columna y perdería datos en este modo.
+    workbook = xlsxwriter.Workbook(output, {
+        'constant_memory': True,
+        'strings_to_urls': False,
+        'strings_to_formulas': False,
+        'nan_inf_to_errors': True,
+        'remove_timezone': True,
+        'default_date_format': 'yyyy-mm-dd hh:mm:ss',
+    })
+    hoja = workbook.add_worksheet('Consolidado')
+    hoja.write_row(0, 0, [str(col) for col in df.columns])
+    escritores = [elegir_escritor(hoja, dtype) for dtype in df.dtypes]
+    for inicio in range(0, len(df), FILAS_POR_BLOQUE):
+        bloque = df.iloc[inicio:inicio + FILAS_POR_BLOQUE]
+        columnas = [serie.astype(object).where(serie.notna(), None).tolist() for _, serie in bloque.items()]
+        for nro_fila, fila in enumerate(zip(*columnas), start=inicio + 1):
+            for nro_col, valor in enumerate(fila):
+                if valor is not None:
+                    escritores[nro_col](nro_fila, nro_col, valor)
+    workbook.close()
     return output.getvalue()
 
+def cachear_por_huella(cache: dict, df: pd.DataFrame, funcion):
+    clave = huella_dataframe(df)
+    if clave not in cache:
+        # Solo se conserva el último consolidado para no acumular resultados en la sesión.
+        cache.clear()
+        cache[clave] = funcion(df)
+    return cache[clave]
+
+def convertir_a_excel(df: pd.DataFrame) -> Callable[[], bytes]:
+    # st.download_button ejecuta el callable al hacer clic, en otro hilo sin acceso a
+    # st.session_state; por eso la caché se toma aquí, en el hilo del script.
+    cache = st.session_state.setdefault('_excel_cache', {})
+    return lambda: cachear_por_huella(cache, df, generar_excel)
+
+def generar_parquet(tabla: pa.Table) -> bytes:
+    # Columnar y comprimido: órdenes de magnitud más rápido que el xlsx y conserva los dtypes.
+    salida = pa.BufferOutputStream()
+    pq.write_table(tabla, salida, compression='zstd')
+    return salida.getvalue().to_pybytes()
+
+def generar_csv(tabla: pa.Table) -> bytes:
+    # Escritor CSV de Arrow (C++) directo a bytes; el BOM hace que Excel lo abra como UTF-8.
+    salida = pa.BufferOutputStream()
+    salida.write(codecs.BOM_UTF8)
+    pacsv.write_csv(tabla, salida)
+    return salida.getvalue().to_pybytes()
+
+def convertir_desde_arrow(df: pd.DataFrame, tabla: pa.Table, clave_cache: str,
+                          generar: Callable[[pa.Table], bytes]) -> Callable[[], bytes]:
+    # Parquet y CSV parten de la tabla Arrow ya armada para la vista previa, sin otra conversión.
+    cache = st.session_state.setdefault(clave_cache, {})
+    return lambda: cachear_por_huella(cache, df, lambda _: generar(tabla))
+
+def preparar_para_mostrar(df: pd.DataFrame) -> pa.Table:
+    # Normalmente el consolidado pasa a Arrow tal cual, sin copia previa; las categóricas viajan
+    # como diccionarios. Solo si alguna columna object (o categórica con categorías object) mezcla
+    # tipos se pasan esas columnas a texto.
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        pass
+    columnas_texto = {
+        col: serie.astype(object).fillna('').astype(str)
+        for col, serie in df.items()
+        if serie.dtype == object
+        or (isinstance(serie.dtype, pd.CategoricalDtype) and serie.dtype.categories.dtype == object)
+    }
+    return pa.Table.from_pandas(df.assign(**columnas_texto), preserve_index=False)
+
+def convertir_a_arrow(df: pd.DataFrame) -> pa.Table:
+    return cachear_por_huella(st.session_state.setdefault('_arrow_cache', {}), df, preparar_para_mostrar)
+
+class TablaMarcasCombinantes(dict):
+    # Tabla de str.translate que se llena a medida que aparecen caracteres: las marcas
+    # combinantes (categoría Mn) se borran y el resto se conserva. unicodedata.category se
+    # consulta una vez por carácter distinto, no por cada aparición.
+    def __missing__(self, codigo: int):
+        valor = None if unicodedata.category(chr(codigo)) == 'Mn' else codigo
+        self[codigo] = valor
+        return valor
+
+TABLA_MARCAS_COMBINANTES = TablaMarcasCombinantes()
+
+def quitar_diacriticos(s: str) -> str:
+    if s.isascii():
+        return s
+    # Quick Check de Unicode: si ya está en NFD no hace falta descomponer de nuevo.
+    if not unicodedata.is_normalized('NFD', s):
+        s = unicodedata.normalize('NFD', s)
+    return s.translate(TABLA_MARCAS_COMBINANTES)
+
+def construir_tabla_normalizacion() -> dict:
+    # Letras latinas precompuestas (Latin-1 y Latin Extended) -> su base ASCII, más los reemplazos
+    # de normalizar_nombre_columna, para resolver los nombres habituales con un solo str.translate.
+    tabla = {' ': '_', '-': '_', '°': 'nro', 'º': 'nro'}
+    for codigo in range(0xC0, 0x250):
+        base = quitar_diacriticos(chr(codigo))
+        if base != chr(codigo) and base.isascii():
+            tabla[chr(codigo)] = base
+    return str.maketrans(tabla)
+
+TABLA_NORMALIZACION = construir_tabla_normalizacion()
+GUIONES_BAJOS_RE = re.compile(r'__+')
+
+# Los encabezados se repiten en cada archivo: cada nombre distinto se normaliza una sola vez.
+@lru_cache(maxsize=4096)
 def normalizar_nombre_columna(col_name: str) -> str:
     if not isinstance(col_name, str): col_name = str(col_name)
     s = col_name.lower().strip()
-    s = ''.join(c for c in unicodedata.normalize('NFD', s) if unicodedata.category(c) != 'Mn')
-    s = s.replace(' ', '_').replace('-', '_').replace('°', 'nro').replace('º', 'nro')
-    s = re.sub(r'__+', '_', s)
+    traducido = s.translate(TABLA_NORMALIZACION)
+    if traducido.isascii():
+        if '__' in traducido:
+            traducido = GUIONES_BAJOS_RE.sub('_', traducido)
+        return limpiar_caracteres_ilegales(traducido)
+    # Quedan caracteres fuera de la tabla: camino completo con descomposición NFD.
+    # Tras quitar los diacríticos, la misma tabla hace los cuatro reemplazos en una sola pasada.
+    s = quitar_diacriticos(s).translate(TABLA_NORMALIZACION)
+    s = GUIONES_BAJOS_RE.sub('_', s)
     s = limpiar_caracteres_ilegales(s)
     return s
 
+def detectar_codificacion(muestra: bytes) -> Tuple[Optional[str], str]:
+    # Devuelve también la muestra decodificada para no volver a decodificarla al buscar el separador.
+    if muestra.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        candidatas = ['utf-16']
+    elif muestra.isascii():
+        # Caso más común: se resuelve sin probar decodificadores ni lanzar excepciones. Con 'utf-8'
+        # pyarrow además lee los bytes directamente, sin transcodificar.
+        return 'utf-8', muestra.decode('ascii')
+    else:
+        candidatas = POSIBLES_CODIFICACIONES[1:]
+    for encoding in candidatas:
+        try:
+            # final=False tolera un carácter multibyte cortado al final de la muestra.
+            return encoding, DECODIFICADORES[encoding]().decode(muestra, final=False)
+        except UnicodeDecodeError:
+            continue
+    return None, ''
+
+def detectar_delimitador(muestra: str) -> str:
+    # Un único histograma de bytes en lugar de un str.count por separador. Los separadores
+    # son ASCII, y en UTF-8 un byte ASCII nunca forma parte de un carácter multibyte.
+    conteos = np.bincount(np.frombuffer(muestra.encode('utf-8', 'ignore'), dtype=np.uint8), minlength=256)
+    conteos = conteos[CODIGOS_SEPARADORES]
+    # Solo compiten los candidatos presentes en el encabezado: una coma dentro de los textos no
+    # debe ganarle al ';' que separa las columnas.
+    encabezado = muestra.split('\n', 1)[0]
+    en_encabezado = np.array([sep in encabezado for sep in SEPARADORES_CANDIDATOS])
+    if en_encabezado.any():
+        conteos = np.where(en_encabezado, conteos, -1)
+    # argmax devuelve el primer máximo, así que un empate (o ningún separador) favorece a ','.
+    return SEPARADORES_CANDIDATOS[int(np.argmax(conteos))]
+
+def nombres_columnas_como_pandas(nombres: list) -> list:
+    # pyarrow y openpyxl dejan vacíos los encabezados en blanco y repiten los duplicados; pandas los
+    # nombra 'Unnamed: i' y 'x.1', que es lo que espera el filtro de columnas 'unnamed'.
+    resultado, repeticiones = [], {}
+    for i, nombre in enumerate(nombres):
+        if nombre is None or nombre == '':
+            nombre = f"Unnamed: {i}"
+        if nombre in repeticiones:
+            repeticiones[nombre] += 1
+            nombre = f"{nombre}.{repeticiones[nombre]}"
+        else:
+            repeticiones[nombre] = 0
+        resultado.append(nombre)
+    return resultado
+
+def leer_csv_arrow(datos, encoding: str, sep: str) -> pa.Table:
+    tabla = pacsv.read_csv(
+        pa.BufferReader(pa.py_buffer(datos)),
+        read_options=pacsv.ReadOptions(encoding=encoding, use_threads=True, block_size=8 << 20),
+        parse_options=pacsv.ParseOptions(delimiter=sep),
+        convert_options=pacsv.ConvertOptions(strings_can_be_null=True),
+    )
+    # Con 'utf-8' pyarrow no valida: una columna con bytes inválidos (p. ej. una 'ñ' latin1 después
+    # de una muestra ASCII) llega como binary en lugar de fallar. Se trata como error de decodificación
+    # para que el llamador pase a la lectura con las demás codificaciones.
+    if any(pa.types.is_binary(campo.type) or pa.types.is_large_binary(campo.type) for campo in tabla.schema):
+        raise pa.ArrowInvalid(f"El texto no es válido en la codificación {encoding}")
+    # Una columna vacía en todas las filas se infiere como null (object de None en pandas); read_csv
+    # y read_excel la entregan como float64 NaN, que alinear_tipos sí unifica con otros archivos.
+    if any(pa.types.is_null(campo.type) for campo in tabla.schema):
+        tabla = tabla.cast(pa.schema([campo.with_type(pa.float64()) if pa.types.is_null(campo.type) else campo
+                                      for campo in tabla.schema]))
+    return tabla.rename_columns(nombres_columnas_como_pandas(tabla.column_names))
+
+def contar_filas_csv(cuerpo: bytes) -> int:
+    # Líneas no vacías, que es lo que pyarrow convierte en filas. Un salto de línea entre comillas
+    # hace sobrestimar, nunca subestimar, así que basta con comparar el total tras el parseo.
+    if not cuerpo:
+        return 0
+    lineas = cuerpo.count(b'\n') + (not cuerpo.endswith(b'\n'))
+    vacias = len(re.findall(rb'\n(?=\r?\n)', cuerpo)) + bool(re.match(rb'\r?\n', cuerpo))
+    return lineas - vacias
+
+def leer_csv_homogeneos(files: List[UploadedFile]) -> Optional[List[Tuple[Optional[pd.DataFrame], Optional[Exception]]]]:
+    # Vía rápida: si todos los uploads son CSV con la misma línea de encabezado byte a byte, se
+    # parsean juntos en una sola pasada de pyarrow y luego se reparten por archivo. Devuelve None
+    # cuando no aplica, para que el llamador use la lectura por archivo.
+    if len(files) < 2 or not all(f.name.lower().endswith(('.csv', '.txt')) for f in files):
+        return None
+
+    buffers = [file.getbuffer() for file in files]
+    muestra = bytes(buffers[0][:TAMANO_MUESTRA])
+    fin_encabezado = muestra.find(b'\n') + 1
+    encabezado = muestra[:fin_encabezado]
+    if not fin_encabezado or any(bytes(buf[:fin_encabezado]) != encabezado for buf in buffers[1:]):
+        return None
+    encoding, texto_muestra = detectar_codificacion(muestra)
+    if encoding not in ('utf-8-sig', 'utf-8', 'latin1', 'windows-1252'):
+        return None
+    # Los archivos se decodifican juntos: si alguno tiene otra codificación (p. ej. uno latin1 y
+    # otro UTF-8) se usa la lectura por archivo en lugar de producir mojibake.
+    if any(detectar_codificacion(bytes(buf[:TAMANO_MUESTRA]))[0] != encoding for buf in buffers[1:]):
+        return None
+
+    cuerpos = [bytes(buf[fin_encabezado:]) for buf in buffers]
+    cuerpos = [c if not c or c.endswith(b'\n') else c + b'\n' for c in cuerpos]
+    filas = [contar_filas_csv(c) for c in cuerpos]
+    try:
+        tabla = leer_csv_arrow(encabezado + b''.join(cuerpos), encoding, detectar_delimitador(texto_muestra))
+    except (pa.ArrowInvalid, UnicodeDecodeError):
+        return None
+    if tabla.num_rows != sum(filas):
+        return None
+
+    df = tabla.to_pandas(date_as_object=False)
+    limites = np.cumsum([0] + filas)
+    return [(df.iloc[inicio:fin].reset_index(drop=True), None) for inicio, fin in zip(limites[:-1], limites[1:])]
+
+def leer_xlsx_streaming(file: UploadedFile) -> pd.DataFrame:
+    # Modo read_only: openpyxl no construye objetos Cell, solo entrega valores fila a fila.
+    file.seek(0)
+    wb = load_workbook(file, read_only=True, data_only=True)
+    try:
+        filas = wb.worksheets[0].iter_rows(values_only=True)
+        encabezado = next(filas, None)
+        if encabezado is None:
+            return pd.DataFrame()
+        encabezado = nombres_columnas_como_pandas(encabezado)
+        n_cols = len(encabezado)
+        columnas = [[] for _ in encabezado]
+        # openpyxl entrega también las filas vacías del final del rango usado; read_excel las recorta.
+        filas_con_datos = 0
+        for nro_fila, fila in enumerate(filas, start=1):
+            for i, valor in enumerate(fila[:n_cols]):
+                columnas[i].append(valor)
+            for i in range(len(fila), n_cols):
+                columnas[i].append(None)
+            if any(valor is not None for valor in fila[:n_cols]):
+                filas_con_datos = nro_fila
+    finally:
+        wb.close()
+
+    df = pd.DataFrame({i: columna[:filas_con_datos] for i, columna in enumerate(columnas)})
+    df.columns = encabezado
+    return df
+
+def hash_archivo_cargado(file: UploadedFile) -> str:
+    # El resultado depende del nombre (extensión y mensajes) además del contenido.
+    return file.name + ':' + hashlib.blake2b(file.getbuffer(), digest_size=16).hexdigest()
+
+# Cada rerun de Streamlit volvería a parsear todos los uploads; con la caché solo se parsea
+# contenido nuevo. Los st.warning/st.info de la función se reproducen al acertar en caché.
+# Entradas acotadas en número y en tiempo: cada una retiene un DataFrame completo en memoria.
+@st.cache_data(hash_funcs={UploadedFile: hash_archivo_cargado}, show_spinner=False, max_entries=64, ttl=TTL_CACHE)
 def leer_archivo(file: UploadedFile) -> Optional[pd.DataFrame]:
     nombre_archivo = file.name.lower()
     
     if nombre_archivo.endswith(('.csv', '.txt')):
-        posibles_codificaciones = ['utf-16', 'utf-8-sig', 'utf-8', 'latin1', 'windows-1252']
-        for encoding in posibles_codificaciones:
-            try:
-                file.seek(0)
-                return pd.read_csv(file, encoding=encoding, sep=None, engine='python', header=0, skip_blank_lines=True)
-            except (UnicodeDecodeError, pd.errors.ParserError):
-                continue
+        # getbuffer() expone el buffer del upload sin copiarlo (getvalue() duplicaría todo el archivo).
+        datos = file.getbuffer()
+        muestra = bytes(datos[:TAMANO_MUESTRA])
+        encoding, texto_muestra = detectar_codificacion(muestra)
+        if encoding is None:
+            st.warning(f"No se pudo leer el archivo de texto '{file.name}' con ninguna de las codificaciones probadas.")
+            return None
+        sep = detectar_delimitador(texto_muestra)
+
+        try:
+            # date_as_object=False: las fechas ISO (date32) llegan como datetime64, igual que desde Excel,
+            # y no como objetos datetime.date que no se pueden mezclar con ellas al consolidar.
+            return leer_csv_arrow(datos, encoding, sep).to_pandas(date_as_object=False)
+        except (pa.ArrowInvalid, UnicodeDecodeError):
+            pass
+
+        # Respaldo, desde la codificación detectada en adelante: primero el motor C de pandas con el
+        # separador detectado y, como último recurso, el tokenizador Python con su propio sniffer.
+        campos_encabezado = texto_muestra.split('\n', 1)[0].count(sep) + 1
+        for encoding in POSIBLES_CODIFICACIONES[POSIBLES_CODIFICACIONES.index(encoding):]:
+            for motor, separador in (('c', sep), ('python', None)):
+                try:
+                    df = pd.read_csv(BytesIO(datos), encoding=encoding, sep=separador, engine=motor, header=0, skip_blank_lines=True)
+                except (UnicodeError, pd.errors.ParserError):
+                    continue
+                # Con un separador equivocado el motor C no falla: si las filas traen más campos que el
+                # encabezado, usa los sobrantes como índice. Ese resultado se descarta y se prueba el sniffer.
+                if motor == 'c' and (not isinstance(df.index, pd.RangeIndex) or df.shape[1] != campos_encabezado):
+                    continue
+                return df
         st.warning(f"No se pudo leer el archivo de texto '{file.name}' con ninguna de las codificaciones probadas.")
         return None
 
     elif nombre_archivo.endswith(('.xlsx', '.xls')):
         try:
+            if nombre_archivo.endswith('.xlsx'):
+                if CALAMINE_DISPONIBLE:
+                    # Parser nativo (Rust); openpyxl en streaming queda como respaldo.
+                    file.seek(0)
+                    return pd.read_excel(file, engine='calamine', header=0)
+                return leer_xlsx_streaming(file)
             file.seek(0)
-            engine = 'openpyxl' if nombre_archivo.endswith('.xlsx') else 'xlrd'
-            return pd.read_excel(file, engine=engine, header=0)
+            # calamine también lee el formato binario BIFF; solo se le pasa si el archivo trae la firma
+            # OLE2, así las tablas HTML renombradas a .xls siguen llegando a xlrd y a su respaldo HTML.
+            if CALAMINE_DISPONIBLE and bytes(file.getbuffer()[:8]) == FIRMA_OLE2:
+                return pd.read_excel(file, engine='calamine', header=0)
+            return pd.read_excel(file, engine='xlrd', header=0)
         except Exception as e:
             if 'Expected BOF record' in str(e):
                 st.info(f"'{file.name}' parece ser una tabla HTML. Intentando leerla como tal...")
                 try:
-                    file.seek(0)
-                    dfs = pd.read_html(file, header=0, encoding='utf-8')
+                    # Se decodifica una sola vez (codificación detectada en la muestra) y se parsea con
+                    # lxml, en C, sin recurrir a bs4/html5lib.
+                    datos = file.getbuffer()
+                    encoding, _ = detectar_codificacion(bytes(datos[:TAMANO_MUESTRA]))
+                    texto = str(datos, encoding or 'utf-8', 'replace')
+                    dfs = pd.read_html(StringIO(texto), header=0, flavor='lxml')
                     if dfs: return dfs[0]
                 except Exception:
                     st.warning(f"El archivo '{file.name}' parecía HTML pero no se pudo leer.")
@@ -73,50 +460,173 @@ def leer_archivo(file: UploadedFile) -> Optional[pd.DataFrame]:
     return None
 
 
+def contar_distintos(serie: pd.Series) -> int:
+    # Columnas respaldadas por Arrow: kernel C++ de pyarrow sobre el buffer, sin pasar por objetos Python.
+    if getattr(serie.dtype, 'storage', None) == 'pyarrow':
+        return pc.count_distinct(pa.array(serie.array), mode='only_valid').as_py()
+    return serie.nunique()
+
+def como_categoria(serie: pd.Series, umbral: float = 0.5, tamano_sonda: int = 50_000,
+                   umbral_sonda: float = 0.9) -> Optional[pd.Categorical]:
+    # Una sonda repartida a lo largo de la columna descarta las de alta cardinalidad sin hashear toda
+    # la serie. En una muestra la proporción de distintos sobrestima la de la columna, así que la sonda
+    # solo descarta por sí sola las columnas casi sin repetidos (identificadores, texto libre); si la
+    # sonda es la columna entera, decide con el umbral exacto. Para las candidatas, la confirmación y
+    # la conversión comparten un único factorize (astype('category') volvería a hashear todo).
+    paso = max(1, len(serie) // tamano_sonda)
+    sonda = serie.iloc[::paso]
+    no_nulos = sonda.count()
+    if no_nulos == 0 or contar_distintos(sonda) >= (umbral if paso == 1 else umbral_sonda) * no_nulos:
+        return None
+    try:
+        codigos, categorias = pd.factorize(serie, sort=True)
+    except TypeError:
+        # Valores no comparables entre sí (p. ej. fechas y 0 en una columna de Excel): como hace
+        # astype('category'), las categorías quedan en orden de aparición.
+        codigos, categorias = pd.factorize(serie, sort=False)
+    if len(categorias) >= umbral * np.count_nonzero(codigos >= 0):
+        return None
+    # infer_objects deja a las categorías de una columna object con el dtype de sus valores
+    # (int64, str...), como las infiere astype('category').
+    return pd.Categorical.from_codes(codigos, categories=categorias.infer_objects())
+
+def es_flotante_entera(valores: np.ndarray, tamano_sonda: int = 1024, tamano_bloque: int = 1 << 16) -> bool:
+    # Ida y vuelta por int64 en lugar de un módulo flotante: NaN se acepta, inf y valores fuera de
+    # rango no coinciden. Primero una sonda corta (una columna con decimales suele delatarse en las
+    # primeras filas) y luego bloques, para cortar en el primero con decimales sin recorrer el resto.
+    cortes = [0, tamano_sonda, *range(tamano_sonda + tamano_bloque, len(valores), tamano_bloque), len(valores)]
+    with np.errstate(invalid='ignore'):
+        for inicio, fin in zip(cortes, cortes[1:]):
+            bloque = valores[inicio:fin]
+            if not (np.isnan(bloque) | (bloque == bloque.astype(np.int64))).all():
+                return False
+    return True
+
+def optimizar_tipos(df: pd.DataFrame) -> None:
+    # Una sola pasada por las columnas, despachando según dtype.kind (texto -> category, float entero ->
+    # Int, enteros -> el ancho mínimo que alcanza). Los float reales no se achican: float32 perdería precisión.
+    for i, dtype in enumerate(df.dtypes):
+        serie = df.iloc[:, i]
+        if dtype.kind == 'O' and not isinstance(dtype, pd.CategoricalDtype):
+            categorica = como_categoria(serie)
+            if categorica is not None:
+                df.isetitem(i, categorica)
+            elif dtype == object and pd.api.types.infer_dtype(serie, skipna=True) == 'string':
+                # Texto puro en object (un PyObject por celda) pasa a un buffer Arrow contiguo.
+                df.isetitem(i, serie.astype('string[pyarrow]'))
+        elif isinstance(dtype, np.dtype) and dtype.kind == 'f':
+            if es_flotante_entera(serie.to_numpy()):
+                df.isetitem(i, pd.to_numeric(serie.astype('Int64'), downcast='integer'))
+        elif isinstance(dtype, np.dtype) and dtype.kind in 'iu':
+            df.isetitem(i, pd.to_numeric(serie, downcast='integer'))
+
+def alinear_tipos(dataframes: List[pd.DataFrame]) -> None:
+    # Con dtypes NumPy idénticos en todas las partes, la columna se une con un solo np.concatenate
+    # en vez de degradar a object. Las categóricas las une concatenar_por_columnas.
+    for i in range(dataframes[0].shape[1]):
+        tipos = {df.iloc[:, i].dtype for df in dataframes}
+        if len(tipos) == 1 or not all(isinstance(t, np.dtype) and t.kind in 'iuf' for t in tipos):
+            continue
+        destino = np.result_type(*tipos)
+        for df in dataframes:
+            df.isetitem(i, df.iloc[:, i].astype(destino))
+
+def concatenar_por_columnas(dataframes: List[pd.DataFrame]) -> pd.DataFrame:
+    # Columna a columna evita la alineación y consolidación de bloques de pd.concat. Las columnas
+    # NumPy homogéneas se unen con np.concatenate; las categóricas uniendo sus códigos con
+    # union_categoricals (sin recodificar cada parte); el resto con pd.concat sobre la Serie.
+    columnas = {}
+    for i in range(dataframes[0].shape[1]):
+        partes = [df.iloc[:, i] for df in dataframes]
+        dtype = partes[0].dtype
+        if isinstance(dtype, np.dtype) and all(parte.dtype == dtype for parte in partes):
+            columnas[i] = np.concatenate([parte.to_numpy() for parte in partes])
+        elif all(isinstance(parte.dtype, pd.CategoricalDtype) for parte in partes):
+            columnas[i] = union_categoricals(partes)
+        else:
+            columnas[i] = pd.concat(partes, ignore_index=True)
+    df = pd.DataFrame(columnas, copy=False)
+    df.columns = dataframes[0].columns
+    return df
+
+def leer_archivos_en_paralelo(files: List[UploadedFile]) -> List[Tuple[Optional[pd.DataFrame], Optional[Exception]]]:
+    resultados = [(None, None)] * len(files)
+    if not files:
+        return resultados
+
+    progreso = st.progress(0.0, text="Leyendo archivos...")
+    # Los hilos heredan el contexto de la ejecución para que los avisos de leer_archivo se muestren.
+    # Cada tarea corre además en una copia de los contextvars del llamador: así, con la caché de
+    # procesar_archivos_cargados, esos avisos quedan grabados y se reproducen al acertar.
+    with ThreadPoolExecutor(max_workers=min(MAX_HILOS_LECTURA, len(files)),
+                            initializer=add_script_run_ctx, initargs=(None, get_script_run_ctx())) as executor:
+        futuros = {executor.submit(contextvars.copy_context().run, leer_archivo, file): i for i, file in enumerate(files)}
+        for completados, futuro in enumerate(as_completed(futuros), start=1):
+            error = futuro.exception()
+            resultados[futuros[futuro]] = (None, error) if error else (futuro.result(), None)
+            progreso.progress(completados / len(files), text=f"Leídos {completados} de {len(files)} archivos...")
+    progreso.empty()
+    return resultados
+
+# Los reruns por interacción (expander, descarga) no cambian los uploads: con la caché se salta
+# toda la consolidación. Los avisos de lectura se reproducen igual que en leer_archivo.
+@st.cache_data(hash_funcs={UploadedFile: hash_archivo_cargado}, show_spinner=False, max_entries=8, ttl=TTL_CACHE)
 def procesar_archivos_cargados(files: List[UploadedFile]) -> Tuple[Optional[pd.DataFrame], List[str]]:
     dataframes, mensajes_log, columnas_base, orden_columnas_base = [], [], None, None
+    nombres_origen = []
+
+    resultados = leer_csv_homogeneos(files)
+    if resultados is None:
+        resultados = leer_archivos_en_paralelo(files)
 
-    for file in files:
+    for file, (df, error) in zip(files, resultados):
         try:
-            df = leer_archivo(file)
+            if error is not None: raise error
             if df is None: continue
 
-            filas_originales = len(df)
-            df = df[~df.isnull().all(axis=1)]
-            filas_eliminadas = filas_originales - len(df)
+            # Una sola reducción sobre la máscara de nulos; si no hay filas en blanco (lo habitual)
+            # no se copia ni se reindexa el frame.
+            con_datos = df.notna().to_numpy().any(axis=1)
+            filas_eliminadas = len(df) - int(con_datos.sum())
+            if filas_eliminadas:
+                df = df.iloc[con_datos].reset_index(drop=True)
             
             if df.empty:
                 mensajes_log.append(f"ℹ️ El archivo '{file.name}' resultó estar vacío tras la limpieza y fue ignorado."); continue
 
-            df.reset_index(drop=True, inplace=True)
             df.columns = [normalizar_nombre_columna(col) for col in df.columns]
-            df = df.loc[:, ~df.columns.str.contains('^unnamed')]
+            # Lista de booleanos sobre las etiquetas en vez de una regex; si no hay nada que quitar,
+            # no se crea un frame nuevo.
+            conservar = [not col.startswith('unnamed') for col in df.columns]
+            if not all(conservar):
+                df = df.loc[:, conservar]
 
             if columnas_base is None:
                 if any(col.isdigit() for col in df.columns):
                     mensajes_log.append(f"⚠️ '{file.name}' ignorado para plantilla (encabezado no válido).")
                     continue
-                columnas_base = set(df.columns)
+                columnas_base = frozenset(df.columns)
                 
                 # --- CAMBIO CLAVE: Se elimina sorted() para respetar el orden original ---
-                orden_columnas_base = list(df.columns)
+                orden_columnas_base = df.columns
                 
                 mensajes_log.append(f"✅ Estructura base establecida desde '{file.name}'.")
 
-            if set(df.columns) != columnas_base:
-                faltantes = sorted(list(columnas_base - set(df.columns)))
-                adicionales = sorted(list(set(df.columns) - columnas_base))
-                msg = f"❌ '{file.name}' RECHAZADO. Columnas no coinciden. "
-                if faltantes: msg += f"Faltan: {faltantes}. "
-                if adicionales: msg += f"Sobran: {adicionales}."
-                mensajes_log.append(msg); continue
-
-            df = df[orden_columnas_base]
-            for col in df.select_dtypes(include=['object']).columns:
-                df[col] = df[col].astype(str).apply(limpiar_caracteres_ilegales)
+            elif not df.columns.equals(orden_columnas_base):
+                # Mismas columnas y mismo orden (lo habitual) se aceptan con una comparación directa;
+                # solo si difieren se arman los conjuntos para distinguir reordenamiento de rechazo.
+                columnas_archivo = frozenset(df.columns)
+                if columnas_archivo != columnas_base:
+                    faltantes = sorted(columnas_base - columnas_archivo)
+                    adicionales = sorted(columnas_archivo - columnas_base)
+                    msg = f"❌ '{file.name}' RECHAZADO. Columnas no coinciden. "
+                    if faltantes: msg += f"Faltan: {faltantes}. "
+                    if adicionales: msg += f"Sobran: {adicionales}."
+                    mensajes_log.append(msg); continue
+                df = df[orden_columnas_base]
             
-            df['archivo_origen'] = file.name
             dataframes.append(df)
+            nombres_origen.append(file.name)
             log_msg = f"✅ '{file.name}' procesado."
             if filas_eliminadas > 0:
                 log_msg += f" Se eliminaron {filas_eliminadas} filas en blanco."
@@ -128,15 +638,16 @@ def procesar_archivos_cargados(files: List[UploadedFile]) -> Tuple[Optional[pd.D
     if not dataframes:
         return None, mensajes_log
 
-    df_consolidado = pd.concat(dataframes, ignore_index=True)
-
-    for col in df_consolidado.select_dtypes(include=['object']).columns:
-        if len(df_consolidado) > 0 and df_consolidado[col].nunique() / len(df_consolidado[col].dropna()) < 0.5:
-            df_consolidado[col] = df_consolidado[col].astype('category')
-    for col in df_consolidado.select_dtypes(include=['float']).columns:
-        if (df_consolidado[col].dropna() % 1 == 0).all():
-            df_consolidado[col] = df_consolidado[col].astype('Int64')
+    alinear_tipos(dataframes)
+    df_consolidado = concatenar_por_columnas(dataframes)
+    # archivo_origen se arma una sola vez sobre el consolidado: un código por archivo repetido
+    # según sus filas, en vez de una columna de strings por archivo.
+    codigos, categorias = pd.factorize(pd.Index(nombres_origen))
+    filas_por_archivo = [len(df) for df in dataframes]
+    df_consolidado['archivo_origen'] = pd.Categorical.from_codes(
+        np.repeat(codigos.astype(np.int32), filas_por_archivo), categories=categorias)
 
+    optimizar_tipos(df_consolidado)
     return df_consolidado, mensajes_log
 
 # --- Interfaz de Usuario (UI) ---
@@ -166,18 +677,41 @@ if archivos_cargados:
         archivos_ok = df_final['archivo_origen'].nunique()
         st.success(f"✅ ¡Consolidación exitosa! Se unieron {archivos_ok} archivos, resultando en {df_final.shape[0]} filas y {df_final.shape[1]} columnas.")
         
-        st.dataframe(df_final.astype(object).fillna(''))
+        tabla_final = convertir_a_arrow(df_final)
+        st.dataframe(tabla_final)
         
+        # Cada archivo se genera recién cuando el usuario hace clic en su botón. Parquet va primero:
+        # es la descarga más rápida y liviana; el Excel queda para quien lo necesite. Con
+        # on_click="ignore" el clic no provoca un rerun del script.
+        col_parquet, col_csv, col_excel = st.columns(3)
+        col_parquet.download_button(
+            label="📥 Descargar Parquet",
+            data=convertir_desde_arrow(df_final, tabla_final, '_parquet_cache', generar_parquet),
+            file_name="consolidado.parquet",
+            mime="application/vnd.apache.parquet",
+            on_click="ignore",
+            type="primary"
+        )
+        col_csv.download_button(
+            label="📥 Descargar CSV",
+            data=convertir_desde_arrow(df_final, tabla_final, '_csv_cache', generar_csv),
+            file_name="consolidado.csv",
+            mime="text/csv",
+            on_click="ignore"
+        )
+        # El Excel se genera en otro hilo al hacer clic, donde un error ya no puede mostrarse con
+        # st.error; lo que se puede anticipar (el tamaño de la hoja) se valida aquí.
         try:
-            excel_bytes = convertir_a_excel(df_final)
-            st.download_button(
+            validar_tamano_excel(df_final)
+            col_excel.download_button(
                 label="📥 Descargar Excel Consolidado",
-                data=excel_bytes,
+                data=convertir_a_excel(df_final),
                 file_name="consolidado.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                on_click="ignore"
             )
         except Exception as e:
-            st.error(f"💥 Error al generar el archivo Excel: {e}")
+            col_excel.error(f"💥 Error al generar el archivo Excel: {e}")
     else:
         st.error("❌ No se pudo consolidar ningún archivo. Revise los mensajes en el registro.")
 else: